@@ -0,0 +1,548 @@
+"""Benchmarks for the Merrytek Modbus RTU codec and gateway frame path.
+
+Runs without Home Assistant: ``const.py`` and ``gateway.py`` are loaded as
+submodules of a bare package so the integration's ``__init__.py`` (which
+imports Home Assistant) is never executed.
+
+Usage::
+
+    python benchmarks/bench_gateway.py --output results.json
+    python benchmarks/bench_gateway.py --compare baseline.json --threshold 0.10
+
+The exit status is 2 when a benchmark fails its self-check or, with
+``--compare``, when the baseline cannot be read or compared; it is 1 only
+when a regression is found.
+"""
+from __future__ import annotations
+
+import argparse
+import datetime
+import importlib
+import json
+import logging
+import math
+import platform
+import statistics
+import subprocess
+import sys
+import timeit
+import tracemalloc
+import types
+from pathlib import Path
+from typing import Callable
+
+ROOT = Path(__file__).resolve().parent.parent
+PACKAGE = "merrytek_sensor"
+
+SCHEMA_VERSION = 3
+DEFAULT_ADDRESS_COUNTS = [1, 8, 32, 128, 247]
+RETAINED_TOLERANCE = 0.1
+NOISE_SIGMAS = 3.0
+# Parameters that change timing noise; baselines must use the same values.
+TIMING_PARAMETERS = ("min_time", "repeat")
+
+
+class BenchmarkFailed(Exception):
+    """Raised when a benchmark does not do the work it is meant to measure."""
+
+
+def _load_gateway() -> types.ModuleType:
+    """Import gateway.py as part of the package without running __init__.py."""
+    if PACKAGE not in sys.modules:
+        package = types.ModuleType(PACKAGE)
+        package.__path__ = [str(ROOT)]
+        sys.modules[PACKAGE] = package
+    return importlib.import_module(f"{PACKAGE}.gateway")
+
+
+gateway = _load_gateway()
+FUNC_READ_HOLDING_REGISTERS = gateway.FUNC_READ_HOLDING_REGISTERS
+REG_STATUS = gateway.REG_STATUS
+
+
+def build_reply(address: int, value: int) -> bytes:
+    """Build a read holding registers reply carrying one register value."""
+    data = bytes([
+        address,
+        FUNC_READ_HOLDING_REGISTERS,
+        0x02,
+        (value >> 8) & 0xFF,
+        value & 0xFF,
+    ])
+    crc = gateway.calculate_crc16(data)
+    return data + bytes([crc & 0xFF, (crc >> 8) & 0xFF])
+
+
+def _reference_workload(data: bytes = bytes(range(6))) -> int:
+    """Fixed workload used to measure host speed.
+
+    A frozen copy of the CRC-16 loop, so it has the same instruction mix as
+    the codec but does not change when ``gateway.py`` does.
+    """
+    crc = 0xFFFF
+    for byte in data:
+        crc ^= byte
+        for _ in range(8):
+            if crc & 0x0001:
+                crc = (crc >> 1) ^ 0xA001
+            else:
+                crc >>= 1
+    return crc
+
+
+def _new_gateway(addresses: list[int]):
+    """Create a gateway that is never started, for driving the frame path."""
+    return gateway.MerrytekGateway(None, "127.0.0.1", 0, addresses)
+
+
+def _calibrate(timer: timeit.Timer, min_time: float) -> int:
+    """Return the number of calls that takes at least ``min_time`` seconds.
+
+    Uses the same 1, 2, 5, 10, 20, ... sequence as ``timeit.Timer.autorange``.
+    """
+    number = 1
+    while True:
+        for step in (1, 2, 5):
+            calls = number * step
+            if timer.timeit(calls) >= min_time:
+                return calls
+        number *= 10
+
+
+def _median_stderr(values: list[float]) -> tuple[float, float]:
+    """Return the median and its standard error relative to the median.
+
+    The standard error is estimated from the interquartile range so outlying
+    rounds do not inflate it.
+    """
+    q1, median, q3 = statistics.quantiles(values, n=4) if len(values) > 1 else values * 3
+    stderr = 1.253 * (q3 - q1) / 1.349 / math.sqrt(len(values))
+    return median, stderr / median if median else 0.0
+
+
+def _timing_stats(rounds: list[float]) -> dict:
+    """Summarise per-frame round timings, in seconds, as nanoseconds."""
+    median, stderr = _median_stderr(rounds)
+    return {
+        "ns_per_frame_best": min(rounds) * 1e9,
+        "ns_per_frame_median": median * 1e9,
+        "stderr": stderr,
+        "frames_per_sec": 1.0 / median if median else 0.0,
+    }
+
+
+def _measure_memory(op: Callable[[], None], number: int, frames: int) -> dict:
+    """Measure memory used by ``op`` using tracemalloc.
+
+    ``peak_bytes_per_call`` is the average high-water mark of memory allocated
+    during a single call. It is not divided by frames: temporaries are freed
+    between frames, so the peak does not scale with the frames in a call.
+    ``retained_blocks_per_frame`` is the number of blocks still alive after
+    ``number`` calls, per frame processed (non-zero indicates growth).
+    """
+    op()  # Warm caches so one-time allocations are not counted.
+    tracemalloc.start()
+    try:
+        peaks = []
+        for _ in range(number):
+            tracemalloc.reset_peak()
+            current, _ = tracemalloc.get_traced_memory()
+            op()
+            _, peak = tracemalloc.get_traced_memory()
+            peaks.append(peak - current)
+
+        before = tracemalloc.take_snapshot()
+        for _ in range(number):
+            op()
+        after = tracemalloc.take_snapshot()
+    finally:
+        tracemalloc.stop()
+
+    stats = after.compare_to(before, "lineno")
+    retained = sum(stat.count_diff for stat in stats if stat.count_diff > 0)
+    return {
+        "peak_bytes_per_call": statistics.mean(peaks),
+        "retained_blocks_per_frame": retained / (number * frames),
+    }
+
+
+def _parse_benchmark(
+    name: str, chunks: list[bytes], frames: int
+) -> tuple[Callable[[], None], int, Callable[[], None]]:
+    """Return ``(op, frames per call, check)`` feeding ``chunks`` to a client.
+
+    ``check`` verifies that every call delivered ``frames`` frames that passed
+    the CRC check and left nothing in the buffer, so a parser that starts
+    dropping or holding frames fails instead of looking faster.
+    """
+    client_calls = [0]
+    received = [0]
+
+    def on_frame(frame: bytes) -> None:
+        received[0] += 1
+
+    client = gateway.MerrytekTCPClient(lambda state: None, on_frame)
+
+    def op() -> None:
+        for chunk in chunks:
+            client.data_received(chunk)
+        client_calls[0] += 1
+
+    def check() -> None:
+        expected = client_calls[0] * frames
+        if received[0] != expected or client._buffer:
+            raise BenchmarkFailed(
+                f"{name}: expected {expected} frames, got {received[0]} "
+                f"with {len(client._buffer)} bytes left in the buffer"
+            )
+
+    return op, frames, check
+
+
+def _codec_benchmarks() -> dict[str, tuple[Callable[[], None], int, Callable[[], None] | None]]:
+    """Return ``(op, frames per call, check)`` codec microbenchmarks keyed by name."""
+    gw = _new_gateway([1])
+    request_payload = gw._build_read_registers_command(1, REG_STATUS, 1)[:-2]
+    reply = build_reply(1, 1)
+    reply_payload = reply[:-2]
+    burst = b"".join(build_reply(1, i & 1) for i in range(16))
+
+    client = gateway.MerrytekTCPClient(lambda state: None, lambda frame: None)
+
+    return {
+        "crc16_request": (lambda: gateway.calculate_crc16(request_payload), 1, None),
+        "crc16_reply": (lambda: gateway.calculate_crc16(reply_payload), 1, None),
+        "build_read_command": (
+            lambda: gw._build_read_registers_command(1, REG_STATUS, 1), 1, None
+        ),
+        "verify_crc": (lambda: client._verify_crc(reply), 1, None),
+        "parse_frame": _parse_benchmark("parse_frame", [reply], 1),
+        "parse_split_frame": _parse_benchmark("parse_split_frame", [reply[:3], reply[3:]], 1),
+        "parse_burst_16": _parse_benchmark("parse_burst_16", [burst], 16),
+    }
+
+
+def _end_to_end_benchmarks(
+    address_counts: list[int],
+) -> dict[str, tuple[Callable[[], None], int, Callable[[], None]]]:
+    """Return ``(op, frames per call, check)`` poll cycles keyed by address count.
+
+    For every address a cycle queues the read command with
+    ``MerrytekGateway.read_presence_status``, takes it off the TX queue as
+    ``_tx_loop`` would (without writing it to a transport or sleeping), then
+    feeds the synthetic reply into ``MerrytekTCPClient.data_received``, which
+    dispatches to ``MerrytekGateway._on_frame_received``. Presence alternates
+    between cycles so every frame produces a state change and a callback;
+    ``check`` verifies that every callback fired.
+    """
+    benchmarks = {}
+    for count in address_counts:
+        addresses = list(range(1, count + 1))
+        gw = _new_gateway(addresses)
+        client = gateway.MerrytekTCPClient(gw._on_connection_state, gw._on_frame_received)
+        tx_queue = gw._tx_queue
+        replies = [
+            [build_reply(addr, value) for addr in addresses] for value in (1, 0)
+        ]
+        cycle = [0]
+        callbacks = [0]
+
+        def on_presence(state: bool, callbacks=callbacks) -> None:
+            callbacks[0] += 1
+
+        for addr in addresses:
+            gw.register_presence_callback(addr, on_presence)
+
+        def poll_cycle(
+            gw=gw, client=client, tx_queue=tx_queue, addresses=addresses,
+            replies=replies, cycle=cycle,
+        ) -> None:
+            for addr, reply in zip(addresses, replies[cycle[0] & 1]):
+                gw.read_presence_status(addr)
+                tx_queue.get_nowait()
+                client.data_received(reply)
+            cycle[0] += 1
+
+        def check(count=count, cycle=cycle, callbacks=callbacks) -> None:
+            expected = cycle[0] * count
+            if callbacks[0] != expected:
+                raise BenchmarkFailed(
+                    f"{count} addresses: expected {expected} callbacks, got {callbacks[0]}"
+                )
+
+        benchmarks[str(count)] = (poll_cycle, count, check)
+    return benchmarks
+
+
+def run_benchmarks(address_counts: list[int], repeat: int, min_time: float) -> dict:
+    """Run every benchmark and return results keyed by suite and name.
+
+    Each benchmark is first calibrated so one round takes at least
+    ``min_time`` seconds, as ``timeit.Timer.autorange`` does, so fast
+    benchmarks are not dominated by timer resolution. Rounds are then
+    interleaved across all benchmarks, so a slow period on the host affects
+    one round of many benchmarks rather than every round of one, and the
+    median over many short rounds is not thrown off by it. Every round is
+    paired with a round of a fixed reference workload run just before it;
+    ``relative_median`` is the median of the paired ratios, which cancels
+    host speed changes slower than one pair. ``timeit`` disables the garbage
+    collector while a round runs. Each benchmark's ``check`` runs after
+    calibration and again after timing, raising ``BenchmarkFailed``.
+    """
+    suites = {
+        "codec": _codec_benchmarks(),
+        "end_to_end": _end_to_end_benchmarks(address_counts),
+    }
+    reference = timeit.Timer(_reference_workload)
+    reference_calls = _calibrate(reference, min_time)
+    entries = []
+    for suite, benchmarks in suites.items():
+        for name, (op, frames, check) in benchmarks.items():
+            timer = timeit.Timer(op)
+            entries.append((suite, name, timer, _calibrate(timer, min_time), frames))
+            if check is not None:
+                check()
+
+    reference_rounds = []
+    rounds: dict[tuple[str, str], list[float]] = {}
+    relative: dict[tuple[str, str], list[float]] = {}
+    for _ in range(repeat):
+        for suite, name, timer, calls, frames in entries:
+            host = reference.timeit(reference_calls) / reference_calls
+            per_frame = timer.timeit(calls) / (calls * frames)
+            reference_rounds.append(host)
+            rounds.setdefault((suite, name), []).append(per_frame)
+            relative.setdefault((suite, name), []).append(per_frame / host)
+
+    results: dict[str, dict] = {
+        "reference": {
+            "host": {"calls_per_round": reference_calls, **_timing_stats(reference_rounds)},
+        },
+    }
+    for suite, name, timer, calls, frames in entries:
+        op, _, check = suites[suite][name]
+        relative_median, relative_stderr = _median_stderr(relative[(suite, name)])
+        results.setdefault(suite, {})[name] = {
+            "frames_per_call": frames,
+            "calls_per_round": calls,
+            **_timing_stats(rounds[(suite, name)]),
+            "relative_median": relative_median,
+            "relative_stderr": relative_stderr,
+            **_measure_memory(op, 1000 if suite == "codec" else 20, frames),
+        }
+        if check is not None:
+            check()
+    return results
+
+
+def _git_revision() -> str | None:
+    """Return the current git commit, if available."""
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=ROOT,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class IncompatibleResults(Exception):
+    """Raised when two result files cannot be compared."""
+
+
+def check_compatible(current: dict, baseline: dict) -> None:
+    """Raise ``IncompatibleResults`` if ``baseline`` cannot be compared.
+
+    Only needs the run metadata, so it is called before any benchmark runs.
+    """
+    if not isinstance(baseline, dict):
+        raise IncompatibleResults("baseline is not a JSON object")
+    if baseline.get("schema_version") != current["schema_version"]:
+        raise IncompatibleResults(
+            f"baseline schema_version {baseline.get('schema_version')!r} "
+            f"does not match {current['schema_version']!r}"
+        )
+    if baseline.get("implementation") != current["implementation"]:
+        raise IncompatibleResults(
+            f"baseline implementation {baseline.get('implementation')!r} "
+            f"does not match {current['implementation']!r}"
+        )
+    for key in TIMING_PARAMETERS:
+        old = baseline.get("parameters", {}).get(key)
+        if old != current["parameters"][key]:
+            raise IncompatibleResults(
+                f"baseline parameter {key}={old!r} does not match "
+                f"{current['parameters'][key]!r}; timings are not comparable"
+            )
+    if "host" not in baseline.get("reference", {}):
+        raise IncompatibleResults("baseline has no reference timing")
+
+
+def compare(
+    current: dict, baseline: dict, threshold: float, alloc_threshold: float
+) -> tuple[list[str], list[str]]:
+    """Compare results against a baseline and return ``(regressions, warnings)``.
+
+    ``check_compatible`` must have accepted the baseline. Raises
+    ``IncompatibleResults`` when no benchmark is present in both.
+
+    Timing uses ``relative_median``, the time per frame relative to a
+    reference workload run alongside it, so a slower or faster host is not
+    reported. The allowed slowdown is ``threshold`` plus ``NOISE_SIGMAS``
+    times the combined relative standard error of both medians.
+    ``peak_bytes_per_call`` may grow by ``alloc_threshold`` and
+    ``retained_blocks_per_frame`` by ``RETAINED_TOLERANCE`` before a
+    regression is reported.
+    """
+    warnings = []
+    if baseline.get("python") != current["python"]:
+        warnings.append(f"python differs: {baseline.get('python')} -> {current['python']}")
+    for key, value in current["parameters"].items():
+        old = baseline.get("parameters", {}).get(key)
+        if key not in TIMING_PARAMETERS and old != value:
+            warnings.append(f"parameter {key} differs: {old} -> {value}")
+
+    old_host = baseline["reference"]["host"]
+    new_host = current["reference"]["host"]
+    host_factor = new_host["ns_per_frame_median"] / old_host["ns_per_frame_median"]
+    if abs(host_factor - 1.0) > threshold:
+        warnings.append(f"host speed differs: reference workload {host_factor:.2f}x")
+
+    regressions = []
+    compared = 0
+    for suite in ("codec", "end_to_end"):
+        new_suite = current.get(suite, {})
+        old_suite = baseline.get(suite, {})
+        for name in sorted(old_suite.keys() - new_suite.keys()):
+            warnings.append(f"{suite}/{name}: only in baseline, not compared")
+        for name in sorted(new_suite.keys() - old_suite.keys()):
+            warnings.append(f"{suite}/{name}: not in baseline, not compared")
+
+        for name in sorted(new_suite.keys() & old_suite.keys()):
+            new, old = new_suite[name], old_suite[name]
+            compared += 1
+
+            ratio = new["relative_median"] / old["relative_median"]
+            noise = math.sqrt(old["relative_stderr"] ** 2 + new["relative_stderr"] ** 2)
+            allowed = 1.0 + threshold + NOISE_SIGMAS * noise
+            if ratio > allowed:
+                regressions.append(
+                    f"{suite}/{name}: {old['ns_per_frame_median']:.0f} -> "
+                    f"{new['ns_per_frame_median']:.0f} ns/frame, "
+                    f"{ratio:.2f}x relative to reference (allowed {allowed:.2f}x)"
+                )
+
+            old_peak = old["peak_bytes_per_call"]
+            new_peak = new["peak_bytes_per_call"]
+            if new_peak > old_peak * (1.0 + alloc_threshold):
+                regressions.append(
+                    f"{suite}/{name}: {old_peak:.0f} -> {new_peak:.0f} peak bytes/call"
+                )
+
+            old_retained = old["retained_blocks_per_frame"]
+            new_retained = new["retained_blocks_per_frame"]
+            if new_retained > old_retained + RETAINED_TOLERANCE:
+                regressions.append(
+                    f"{suite}/{name}: {old_retained:.3f} -> {new_retained:.3f} "
+                    "retained blocks/frame"
+                )
+
+    if not compared:
+        raise IncompatibleResults("no benchmarks in common with the baseline")
+    return regressions, warnings
+
+
+def main(argv: list[str] | None = None) -> int:
+    """Run the benchmarks and write JSON results."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--min-time", type=float, default=0.05,
+                        help="minimum seconds per timing round")
+    parser.add_argument("--repeat", type=int, default=21,
+                        help="timing rounds per benchmark")
+    parser.add_argument("--addresses", type=int, nargs="+", default=DEFAULT_ADDRESS_COUNTS,
+                        help="address counts for end-to-end benchmarks (1-247)")
+    parser.add_argument("--output", type=Path,
+                        help="write JSON results to this file instead of stdout")
+    parser.add_argument("--compare", type=Path,
+                        help="baseline JSON results to compare against")
+    parser.add_argument("--threshold", type=float, default=0.10,
+                        help="allowed slowdown, on top of measured noise, "
+                             "before reporting a regression")
+    parser.add_argument("--alloc-threshold", type=float, default=0.10,
+                        help="allowed growth of peak bytes per call "
+                             "before reporting a regression")
+    args = parser.parse_args(argv)
+
+    if args.repeat < 1:
+        parser.error(f"--repeat must be at least 1, got {args.repeat}")
+    if args.min_time < 0:
+        parser.error(f"--min-time must not be negative, got {args.min_time}")
+    for count in args.addresses:
+        if not 1 <= count <= 247:
+            parser.error(f"address count must be between 1 and 247, got {count}")
+    addresses = list(dict.fromkeys(args.addresses))
+
+    results = {
+        "schema_version": SCHEMA_VERSION,
+        "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "git_revision": _git_revision(),
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "platform": platform.platform(),
+        "parameters": {
+            "min_time": args.min_time,
+            "repeat": args.repeat,
+            "addresses": addresses,
+        },
+    }
+
+    # Read the baseline before running anything, so an unusable baseline
+    # fails fast and --output may safely name the same file.
+    baseline = None
+    if args.compare:
+        try:
+            baseline = json.loads(args.compare.read_text(encoding="utf-8"))
+            check_compatible(results, baseline)
+        except (OSError, json.JSONDecodeError, IncompatibleResults) as err:
+            print(f"ERROR {args.compare}: {err}", file=sys.stderr)
+            return 2
+
+    # Keep logging at its production default so debug formatting is not timed.
+    logging.getLogger(PACKAGE).setLevel(logging.WARNING)
+    try:
+        results.update(run_benchmarks(addresses, args.repeat, args.min_time))
+    except BenchmarkFailed as err:
+        print(f"ERROR {err}", file=sys.stderr)
+        return 2
+
+    text = json.dumps(results, indent=2, sort_keys=True)
+    if args.output:
+        args.output.write_text(text + "\n", encoding="utf-8")
+    else:
+        print(text)
+
+    if baseline is not None:
+        try:
+            regressions, warnings = compare(
+                results, baseline, args.threshold, args.alloc_threshold
+            )
+        except IncompatibleResults as err:
+            print(f"ERROR {args.compare}: {err}", file=sys.stderr)
+            return 2
+        except (KeyError, TypeError) as err:
+            print(f"ERROR {args.compare}: malformed baseline ({err!r})", file=sys.stderr)
+            return 2
+        for line in warnings:
+            print(f"WARNING {line}", file=sys.stderr)
+        for line in regressions:
+            print(f"REGRESSION {line}", file=sys.stderr)
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -4,9 +4,7 @@ from __future__ import annotations
 import asyncio
 import logging
 from asyncio import Transport, Protocol, Task, Queue
-from typing import Callable
-
-from homeassistant.core import HomeAssistant
+from typing import TYPE_CHECKING, Callable
 
 from .const import (
     DOMAIN,
@@ -16,6 +14,9 @@ from .const import (
     REG_STATUS,
 )
 
+if TYPE_CHECKING:
+    from homeassistant.core import HomeAssistant
+
 _LOGGER = logging.getLogger(__name__)
 
 